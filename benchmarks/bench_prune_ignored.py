@@ -0,0 +1,70 @@
+"""Time the listing phase on a repo with one huge git-ignored directory.
+
+Usage: python benchmarks/bench_prune_ignored.py [NUM_IGNORED_FILES]
+
+Compares the rsync walk plus git filtering with and without the anchored
+excludes that rstring derives from ``git ls-files --directory``. The ignore
+rule lives in a nested .gitignore, as in a monorepo, so the root-level rsync
+excludes from ``parse_gitignore`` can't prune it on their own.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rstring.git import list_ignored_directories
+from rstring.pipeline import iter_files
+from rstring.utils import get_prune_patterns, parse_gitignore
+
+
+def build_tree(root, num_ignored):
+    subprocess.run(['git', 'init', '-q'], cwd=root, check=True)
+    with open(os.path.join(root, '.gitignore'), 'w') as f:
+        f.write("*.pyc\n")
+    os.makedirs(os.path.join(root, 'web'))
+    with open(os.path.join(root, 'web', '.gitignore'), 'w') as f:
+        f.write("node_modules/\n")
+    for i in range(50):
+        with open(os.path.join(root, f"module_{i}.py"), 'w') as f:
+            f.write(f"VALUE = {i}\n")
+    per_dir = 100
+    for i in range(num_ignored):
+        directory = os.path.join(root, 'web', 'node_modules', f"pkg_{i // per_dir}")
+        if i % per_dir == 0:
+            os.makedirs(directory)
+        with open(os.path.join(directory, f"file_{i}.js"), 'w') as f:
+            f.write("module.exports = {};\n")
+
+
+def time_listing(root, rsync_args):
+    start = time.perf_counter()
+    files = list(iter_files(rsync_args, root, use_gitignore=True))
+    return time.perf_counter() - start, len(files)
+
+
+def main():
+    num_ignored = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as root:
+        build_tree(root, num_ignored)
+        base_args = parse_gitignore(os.path.join(root, '.gitignore')) + ['--include=*/', '.']
+
+        start = time.perf_counter()
+        prune_args = get_prune_patterns(list_ignored_directories(root))
+        prune_cost = time.perf_counter() - start
+
+        baseline, baseline_files = time_listing(root, base_args)
+        pruned, pruned_files = time_listing(root, prune_args + base_args)
+
+    assert baseline_files == pruned_files, (baseline_files, pruned_files)
+    print(f"Ignored files on disk:   {num_ignored:,}")
+    print(f"Selected files:          {pruned_files:,}")
+    print(f"Without pruning:         {baseline:.3f}s")
+    print(f"With pruning:            {pruned + prune_cost:.3f}s "
+          f"(git ls-files {prune_cost:.3f}s + walk {pruned:.3f}s)")
+
+
+if __name__ == '__main__':
+    main()
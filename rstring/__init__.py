@@ -1,3 +1,4 @@
 from .cli import main
+from .session import Session
 
-__all__ = ["main"]
+__all__ = ["main", "Session"]
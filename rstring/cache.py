@@ -0,0 +1,182 @@
+import difflib
+import hashlib
+import json
+import logging
+import os
+import stat
+import subprocess
+import tempfile
+
+from .git import is_git_command_available, is_git_work_tree
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+MAX_CACHE_ENTRIES = 32
+
+
+def get_cache_dir():
+    if os.environ.get('RSTRING_CACHE_DIR'):
+        return os.environ['RSTRING_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'rstring')
+
+
+def _git(target_dir, *args):
+    result = subprocess.run(['git'] + list(args), cwd=target_dir,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.returncode, result.stdout
+
+
+def git_fingerprint(target_dir):
+    """Fingerprint a work tree from HEAD, the index and the stat of every dirty path.
+
+    Clean tracked files are covered by HEAD and the index; modified and
+    untracked ones are listed by ``git status`` and stat'ed so that repeated
+    edits to an already-dirty file still change the fingerprint. Nested
+    repositories and submodules are walked in full.
+    """
+    digest = hashlib.sha256()
+
+    returncode, output = _git(target_dir, 'rev-parse', '--show-toplevel', '--git-path', 'index')
+    if returncode != 0:
+        return None
+    toplevel, index_path = os.fsdecode(output).splitlines()[:2]
+    index_path = os.path.join(target_dir, index_path)
+
+    # git status refreshes and may rewrite the index, so stat it afterwards
+    returncode, status = _git(target_dir, 'status', '--porcelain=v1', '-z', '--untracked-files=all')
+    if returncode != 0:
+        return None
+    digest.update(status)
+
+    _, head = _git(target_dir, 'rev-parse', '-q', '--verify', 'HEAD')
+    digest.update(head)
+    try:
+        index_stat = os.stat(index_path)
+        digest.update(f"index:{index_stat.st_mtime_ns}:{index_stat.st_size}\0".encode())
+    except OSError:
+        digest.update(b"index:missing\0")
+
+    fields = status.split(b'\0')
+    i = 0
+    while i < len(fields):
+        field = fields[i]
+        i += 1
+        if len(field) < 4:
+            continue
+        if field[0:1] in (b'R', b'C'):
+            i += 1  # Skip the rename/copy source, which follows as its own field
+        path = os.path.join(toplevel, os.fsdecode(field[3:]))
+        try:
+            path_stat = os.lstat(path)
+        except OSError:
+            digest.update(b"missing\0")
+            continue
+        if stat.S_ISDIR(path_stat.st_mode):
+            # Nested repositories and submodules are reported as a single entry, and a
+            # directory's mtime doesn't change when a file in it is edited in place
+            digest.update(f"{stat_fingerprint(path)}\0".encode())
+        else:
+            digest.update(f"{path_stat.st_mtime_ns}:{path_stat.st_size}\0".encode())
+
+    return digest.hexdigest()
+
+
+def stat_fingerprint(target_dir):
+    """Fingerprint a directory from the mtime and size of everything beneath it.
+
+    Directory mtimes alone only change when entries are added, removed or
+    renamed, so files are stat'ed too to catch edits in place.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(target_dir):
+        dirs.sort()
+        for name in sorted(files) + dirs:
+            path = os.path.join(root, name)
+            try:
+                path_stat = os.lstat(path)
+            except OSError:
+                continue
+            rel_path = os.path.relpath(path, target_dir)
+            digest.update(f"{rel_path}\0{path_stat.st_mtime_ns}:{path_stat.st_size}\0".encode(
+                'utf-8', errors='surrogateescape'))
+    return digest.hexdigest()
+
+
+def tree_fingerprint(target_dir, use_gitignore=True, include_dirs=False):
+    # Git only vouches for files it doesn't ignore, and never reports empty
+    # directories, so fall back to a full stat walk whenever ignored files or
+    # directory entries may end up in the collection
+    if use_gitignore and not include_dirs and is_git_command_available() and is_git_work_tree(target_dir):
+        fingerprint = git_fingerprint(target_dir)
+        if fingerprint is not None:
+            return f"git:{fingerprint}"
+    return f"stat:{stat_fingerprint(target_dir)}"
+
+
+def make_cache_key(target_dir, rsync_args, options):
+    key = {
+        'version': CACHE_VERSION,
+        'target_dir': target_dir,
+        'rsync_args': rsync_args,
+        'options': options,
+        'fingerprint': tree_fingerprint(target_dir, options.get('use_gitignore', True),
+                                        options.get('include_dirs', False)),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_cached_result(cache_key, cache_dir=None):
+    path = os.path.join(cache_dir or get_cache_dir(), f"{cache_key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+
+
+def save_cached_result(cache_key, result, cache_dir=None):
+    cache_dir = cache_dir or get_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(temp_path, os.path.join(cache_dir, f"{cache_key}.json"))
+        _evict_old_entries(cache_dir)
+    except OSError as e:
+        logger.warning(f"Could not write cache entry: {e}")
+
+
+def _evict_old_entries(cache_dir):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            path = os.path.join(cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    entries.sort(reverse=True)
+    for _, path in entries[MAX_CACHE_ENTRIES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def diff_cached_result(cached, fresh, max_lines=50):
+    """Return a unified diff between a cached and a recomputed result, empty if they match."""
+    diff = []
+    for field in ('output', 'tree'):
+        if cached.get(field) != fresh.get(field):
+            diff.extend(difflib.unified_diff(
+                (cached.get(field) or '').splitlines(), (fresh.get(field) or '').splitlines(),
+                f"cached {field}", f"fresh {field}", lineterm=''))
+    if len(diff) > max_lines:
+        diff = diff[:max_lines] + [f"... {len(diff) - max_lines} more diff lines"]
+    return "\n".join(diff)
@@ -1,15 +1,16 @@
 import argparse
 import logging
 import os
+import subprocess
 import sys
 
-from .utils import (
-    check_rsync, run_rsync, validate_rsync_args,
-    gather_code, interactive_mode, get_tree_string, copy_to_clipboard,
-    parse_gitignore
-)
+from .utils import check_rsync, validate_rsync_args, interactive_mode, copy_to_clipboard
 
-from .git import filter_ignored_files
+from .cache import make_cache_key, load_cached_result, save_cached_result, diff_cached_result
+from .session import Session, get_default_patterns
+from .profiles import parse_profile, select_profiles
+from .shard import SHARD_HEADER, write_shards
+from .stats import CollectionStats, estimate_tokens
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -51,12 +52,54 @@ def parse_target_directory(args):
     return os.path.abspath(target_dir), remaining_args
 
 
-def get_default_patterns():
-    """Conservative default: include everything, let gitignore filter."""
-    return ['--include=*/']
+def build_summary(stats, tree):
+    from datetime import datetime
+    return "\n".join(["### COLLECTION SUMMARY ###", "",
+                      "The following files have been collected using the rstring command.",
+                      "Binary files are truncated to the first 32 bytes.", "", f"Files: {stats.files}",
+                      f"Lines: {stats.lines}",
+                      f"Characters: {stats.chars:,}",
+                      f"Tokens (est.): ~{stats.tokens:,}",
+                      f"Collected at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", "", tree, "",
+                      "### FILE CONTENTS ###"])
+
+
+def write_profiles(session, profiles, profile_dir, summary=False, tree_options=None):
+    """Write one output file per profile, reading each selected file only once."""
+    os.makedirs(profile_dir, exist_ok=True)
+    written = []
+    for name, file_paths in select_profiles(session, profiles):
+        stats = CollectionStats()
+        result = session.output(stats=stats, file_paths=file_paths)
+        if summary:
+            tree = "\n".join(session.iter_tree(file_paths=file_paths, **(tree_options or {})))
+            result = build_summary(stats, tree) + "\n" + result
+        path = os.path.join(profile_dir, f"{name}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(result)
+        written.append((name, path, stats))
+    return written
+
+
+def reject_combined(parser, option, flags):
+    """Exit with a usage error if any of ``flags``, ``(name, given)`` pairs, was given with ``option``."""
+    conflicting = [name for name, given in flags if given]
+    if conflicting:
+        parser.error(f"{option} can't be combined with {', '.join(conflicting)}")
+
+
+def report_cache_verification(cached, fresh):
+    if cached is None:
+        print("Cache verification: no cached result to compare against.", file=sys.stderr)
+        return
+    diff = diff_cached_result(cached, fresh)
+    if diff:
+        print(f"Cache verification: cached result is stale.\n{diff}", file=sys.stderr)
+    else:
+        print("Cache verification: cached result matches a fresh run.", file=sys.stderr)
 
 
-def main():
+def main(argv=None):
     if not check_rsync():
         print("Error: rsync is not installed on this system. Please install rsync and try again.", file=sys.stderr)
         return
@@ -84,12 +127,66 @@ For frequently used patterns, create shell aliases:
     parser.add_argument("-pl", "--preview-length", type=int, metavar="N",
                         help="Show only the first N lines of each file")
     parser.add_argument("-s", "--summary", action="store_true", help="Print a summary including a tree of files")
+    parser.add_argument("--tree-depth", type=int, metavar="N",
+                        help="Summarize directories deeper than N levels in the tree")
+    parser.add_argument("--tree-max-children", type=int, metavar="K",
+                        help="Show at most K entries per directory in the tree, summarizing the rest")
     parser.add_argument("-id", "--include-dirs", action="store_true",
                         help="Include empty directories in output and summary")
     parser.add_argument("-ng", "--no-gitignore", action="store_false", dest="use_gitignore",
                         help="Don't use .gitignore patterns")
-
-    args, unknown_args = parser.parse_known_args()
+    parser.add_argument("--stats", action="store_true",
+                        help="Print per-file and per-directory totals for the heaviest paths")
+    parser.add_argument("--stats-top", type=int, default=10, metavar="N",
+                        help="Number of directories and files to list with --stats (default: 10)")
+    parser.add_argument("--shard-tokens", type=int, metavar="N",
+                        help="Split the collection into files of at most ~N tokens each (requires --shard-dir)")
+    parser.add_argument("--shard-dir", metavar="DIR", help="Directory to write shards to")
+    parser.add_argument("--profile", action="append", metavar="NAME=RULES",
+                        help="Write a view selected by RULES (e.g. \"--include=*/ --include=*.py --exclude=*\") "
+                             "to NAME.txt; repeat for more views of the same scan (requires --profile-dir)")
+    parser.add_argument("--profile-dir", metavar="DIR", help="Directory to write profile outputs to")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse the previous result when neither the arguments nor the files have changed")
+    parser.add_argument("--verify-cache", action="store_true",
+                        help="Recompute the result and report any difference from the cached one")
+
+    args, unknown_args = parser.parse_known_args(argv)
+
+    if args.tree_depth is not None and args.tree_depth < 1:
+        parser.error("--tree-depth must be at least 1")
+    if args.tree_max_children is not None and args.tree_max_children < 0:
+        parser.error("--tree-max-children can't be negative")
+
+    if args.stats_top < 1:
+        parser.error("--stats-top must be at least 1")
+
+    if args.shard_tokens is not None:
+        if not args.shard_dir:
+            parser.error("--shard-tokens requires --shard-dir")
+        header_tokens = estimate_tokens(len(SHARD_HEADER))
+        if args.shard_tokens <= header_tokens:
+            parser.error(f"--shard-tokens must be more than {header_tokens}, the cost of a shard's header")
+        reject_combined(parser, "--shard-tokens", [
+            ("--summary", args.summary), ("--stats", args.stats),
+            ("--cache", args.cache), ("--verify-cache", args.verify_cache),
+        ])
+
+    profiles = []
+    if args.profile:
+        if not args.profile_dir:
+            parser.error("--profile requires --profile-dir")
+        reject_combined(parser, "--profile", [
+            ("--shard-tokens", args.shard_tokens is not None), ("--stats", args.stats),
+            ("--cache", args.cache), ("--verify-cache", args.verify_cache),
+        ])
+        try:
+            profiles = [parse_profile(spec) for spec in args.profile]
+        except ValueError as e:
+            parser.error(str(e))
+        names = [name for name, _ in profiles]
+        if len(set(names)) != len(names):
+            parser.error("Profile names must be unique")
 
     # Parse target directory from -C flag or positional args
     try:
@@ -107,83 +204,136 @@ For frequently used patterns, create shell aliases:
         print(f"Error: Directory '{target_dir}' does not exist.", file=sys.stderr)
         return
 
-    # Use provided patterns or conservative default
-    if rsync_args_base:
-        rsync_args = rsync_args_base
-    else:
-        rsync_args = get_default_patterns()
-
     # Handle gitignore in target directory
-    if args.use_gitignore:
-        gitignore_path = os.path.join(target_dir, '.gitignore')
-        if os.path.exists(gitignore_path):
-            gitignore_patterns = parse_gitignore(gitignore_path)
-            rsync_args = gitignore_patterns + rsync_args
-        else:
-            print(f"Warning: No .gitignore file found in {target_dir}. Use --no-gitignore to ignore .gitignore patterns", file=sys.stderr)
+    if args.use_gitignore and not os.path.exists(os.path.join(target_dir, '.gitignore')):
+        print(f"Warning: No .gitignore file found in {target_dir}. Use --no-gitignore to ignore .gitignore patterns", file=sys.stderr)
 
-    # Add default source if none specified
-    if not any(arg for arg in rsync_args if not arg.startswith('--')):
-        rsync_args.append('.')
+    # Use provided patterns or conservative default. Files are read once per run,
+    # except that profiles share entries between views.
+    session = Session(target_dir, rsync_args_base or get_default_patterns(), use_gitignore=args.use_gitignore,
+                      preview_length=args.preview_length, include_dirs=args.include_dirs,
+                      cache_entries=bool(profiles))
 
     # Change to target directory for rsync execution
     original_cwd = os.getcwd()
     try:
         os.chdir(target_dir)
 
-        if not validate_rsync_args(rsync_args):
-            print("Error: Invalid rsync arguments. Please check and try again.", file=sys.stderr)
-            return
-
         if args.interactive:
-            rsync_args = interactive_mode(rsync_args, args.include_dirs)
-
-        file_list = run_rsync(rsync_args)
-
-        # Apply git filtering if in a git repository and gitignore is enabled
-        if args.use_gitignore:
+            if not validate_rsync_args(session.rsync_args):
+                print("Error: Invalid rsync arguments. Please check and try again.", file=sys.stderr)
+                return
+            session.rsync_args = interactive_mode(session.rsync_args, args.include_dirs)
+
+        if profiles:
+            profile_dir = os.path.join(original_cwd, args.profile_dir)
+            tree_options = {'max_depth': args.tree_depth, 'max_children': args.tree_max_children}
             try:
-                file_list = filter_ignored_files(target_dir, file_list)
-            except Exception as e:
-                logger.warning(f"Git filtering failed: {e}")
+                written = write_profiles(session, profiles, profile_dir, args.summary, tree_options)
+            except subprocess.CalledProcessError:
+                print("Error: Invalid rsync arguments. Please check and try again.", file=sys.stderr)
+                return
+            for name, path, stats in written:
+                print(f"{name}: {stats.files} files ({stats.lines} lines, ~{stats.tokens:,} tokens) "
+                      f"written to {os.path.join(args.profile_dir, os.path.basename(path))}")
+            return
 
-        result = gather_code(file_list, args.preview_length, args.include_dirs)
+        if args.shard_tokens is not None:
+            shard_dir = os.path.join(original_cwd, args.shard_dir)
+            try:
+                shards = write_shards(session, args.shard_tokens, shard_dir)
+            except subprocess.CalledProcessError:
+                print("Error: Invalid rsync arguments. Please check and try again.", file=sys.stderr)
+                return
+            for path, num_files, tokens in shards:
+                print(f"{os.path.join(args.shard_dir, os.path.basename(path))}: {num_files} files, ~{tokens:,} tokens")
+            print(f"Wrote {len(shards)} shards of at most ~{args.shard_tokens:,} tokens to {args.shard_dir}")
+            return
 
-        tree = get_tree_string(file_list, include_dirs=args.include_dirs, use_color=False)
-        num_files = len([f for f in file_list if not os.path.isdir(f)])
+        tree_options = {'max_depth': args.tree_depth, 'max_children': args.tree_max_children}
+        cache_key = None
+        cached = None
+        if args.cache or args.verify_cache:
+            cache_key = make_cache_key(target_dir, session.rsync_args, {
+                'use_gitignore': args.use_gitignore,
+                'preview_length': args.preview_length,
+                'include_dirs': args.include_dirs,
+                'tree_options': tree_options,
+            })
+            cached = load_cached_result(cache_key)
+
+        if cached is not None and not args.verify_cache:
+            stream_output = False
+            result = cached['output']
+            tree = cached['tree']
+            colored_tree = cached['colored_tree']
+            stats = CollectionStats.from_dict(cached['stats'])
+        else:
+            # Listing and git filtering run in the background while files are read;
+            # without a summary or clipboard there's no need to hold the output either
+            stats = CollectionStats()
+            stream_output = args.no_clipboard and not args.summary
+            try:
+                if stream_output:
+                    entries = [] if cache_key is not None else None
+                    print()
+                    for file_path, entry, is_dir in session.iter_chunks():
+                        if stats.entries:
+                            sys.stdout.write("\n\n")
+                        stats.add(file_path, entry, is_dir=is_dir)
+                        sys.stdout.write(entry)
+                        if entries is not None:
+                            entries.append(entry)
+                    print()
+                    result = "\n\n".join(entries) if entries is not None else None
+                else:
+                    result = session.output(stats=stats)
+            except subprocess.CalledProcessError:
+                print("Error: Invalid rsync arguments. Please check and try again.", file=sys.stderr)
+                return
+
+            # The colored tree is otherwise streamed straight to the terminal below
+            tree = colored_tree = None
+            if args.summary or cache_key is not None:
+                tree = session.tree(**tree_options)
+            if cache_key is not None:
+                colored_tree = session.tree(use_color=True, **tree_options)
+                fresh = {'output': result, 'tree': tree, 'colored_tree': colored_tree, 'stats': stats.to_dict()}
+                if args.verify_cache:
+                    report_cache_verification(cached, fresh)
+                save_cached_result(cache_key, fresh)
+
+        num_files = stats.files
 
     finally:
+        session.close()
         os.chdir(original_cwd)
 
+    lines = stats.lines
     if args.summary:
-        from datetime import datetime
-        lines = len(result.splitlines())
-        chars = len(result)
-        tokens = chars // 4  # Rough estimate: 1 token ≈ 4 characters
-        result_with_summary = ["### COLLECTION SUMMARY ###", "",
-                               "The following files have been collected using the rstring command.",
-                               "Binary files are truncated to the first 32 bytes.", "", f"Files: {num_files}",
-                               f"Lines: {lines}",
-                               f"Characters: {chars:,}",
-                               f"Tokens (est.): ~{tokens:,}",
-                               f"Collected at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", "", tree, "",
-                               "### FILE CONTENTS ###", result]
-
-        result = "\n".join(result_with_summary)
+        summary = build_summary(stats, tree)
+        result = summary + "\n" + result
+        lines += summary.count("\n") + 1
 
     if args.no_clipboard:
-        print()
-        print(result)
+        if not stream_output:
+            print()
+            print(result)
     else:
-        colored_tree = get_tree_string(file_list, include_dirs=args.include_dirs)
-        print(colored_tree) if len(colored_tree) > 0 else None
+        if colored_tree is None:
+            for line in session.iter_tree(use_color=True, **tree_options):
+                print(line)
+        elif len(colored_tree) > 0:
+            print(colored_tree)
         copy_to_clipboard(result)
 
+    if args.stats:
+        print(stats.report(args.stats_top), file=sys.stderr)
+
     if not args.no_clipboard:
-        lines = len(result.splitlines())
         chars = len(result)
-        tokens = chars // 4  # Rough estimate: 1 token ≈ 4 characters
-        action = f"Collected {lines} lines ({chars:,} chars, ~{tokens:,} tokens) from {num_files}" if args.no_clipboard else f"Copied {lines} lines ({chars:,} chars, ~{tokens:,} tokens) from {num_files} files to clipboard"
+        tokens = estimate_tokens(chars)
+        action = f"Copied {lines} lines ({chars:,} chars, ~{tokens:,} tokens) from {num_files} files to clipboard"
         target_info = f" from {target_dir}" if target_dir != original_cwd else ""
         if 'RSTRING_TESTING' not in os.environ:
             print(f"{action}{target_info}")
@@ -0,0 +1,125 @@
+import posixpath
+import re
+
+
+def _translate(pattern):
+    """Translate an rsync wildcard pattern into a regular expression."""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif char == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif char == '?':
+            regex.append('[^/]')
+            i += 1
+        elif char == '[':
+            end = pattern.find(']', i + 2 if pattern[i + 1:i + 2] in ('!', '^') else i + 1)
+            if end == -1:
+                regex.append(re.escape(char))
+                i += 1
+                continue
+            body = pattern[i + 1:end]
+            if body[:1] in ('!', '^'):
+                body = '^' + body[1:]
+            regex.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif char == '\\' and i + 1 < len(pattern):
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(char))
+            i += 1
+    return ''.join(regex)
+
+
+class FilterRule:
+    """A single rsync ``--include``/``--exclude`` pattern."""
+
+    def __init__(self, include, pattern):
+        self.include = include
+        self.pattern = pattern
+
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        self.anchored = pattern.startswith('/')
+        pattern = pattern.lstrip('/')
+
+        # "dir/***" matches the directory itself as well as everything inside it
+        suffix = ''
+        if pattern.endswith('/***'):
+            pattern = pattern[:-4]
+            suffix = '(?:/.*)?'
+        self.full_path = '/' in pattern or '**' in pattern or bool(suffix)
+
+        regex = _translate(pattern) + suffix + '$'
+        if self.anchored:
+            self.regex = re.compile('^' + regex)
+        elif self.full_path:
+            self.regex = re.compile('(?:^|/)' + regex)
+        else:
+            self.regex = re.compile('^' + regex)
+
+    def matches(self, path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        target = path if self.full_path or self.anchored else posixpath.basename(path)
+        return self.regex.search(target) is not None
+
+
+class RsyncFilter:
+    """Evaluates rsync include/exclude rules against paths without running rsync.
+
+    Follows rsync's semantics: the first matching rule decides, unmatched
+    paths are included, and an excluded directory hides everything below it.
+    Only ``--include`` and ``--exclude`` are supported.
+    """
+
+    def __init__(self, rules):
+        self.rules = parse_filter_rules(rules)
+        self._directories = {}
+
+    def _decide(self, path, is_dir):
+        for rule in self.rules:
+            if rule.matches(path, is_dir):
+                return rule.include
+        return True
+
+    def _directory_included(self, path):
+        if path not in self._directories:
+            parent = posixpath.dirname(path)
+            included = (not parent or self._directory_included(parent)) and self._decide(path, True)
+            self._directories[path] = included
+        return self._directories[path]
+
+    def is_included(self, path, is_dir=False):
+        parent = posixpath.dirname(path)
+        if parent and not self._directory_included(parent):
+            return False
+        return self._decide(path, is_dir)
+
+
+def parse_filter_rules(args):
+    """Parse ``--include``/``--exclude`` arguments into a list of ``FilterRule``."""
+    rules = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        for option in ('--include', '--exclude'):
+            if arg == option:
+                if i + 1 >= len(args):
+                    raise ValueError(f"{option} requires a pattern")
+                rules.append(FilterRule(option == '--include', args[i + 1]))
+                i += 2
+                break
+            if arg.startswith(option + '='):
+                rules.append(FilterRule(option == '--include', arg.split('=', 1)[1]))
+                i += 1
+                break
+        else:
+            raise ValueError(f"Unsupported filter argument '{arg}': only --include and --exclude are supported")
+    return rules
@@ -1,4 +1,5 @@
 import logging
+import os
 import subprocess
 
 logger = logging.getLogger(__name__)
@@ -31,16 +32,147 @@ def is_ignored_by_git(target_dir, file_path):
         return False
 
 
-def filter_ignored_files(target_dir, file_list):
+def is_git_work_tree(target_dir):
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--is-inside-work-tree'],
+            cwd=target_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        return result.returncode == 0 and result.stdout.strip() == 'true'
+    except FileNotFoundError:
+        return False
+
+
+def list_ignored_directories(target_dir):
+    """Return directories under ``target_dir`` that git ignores in their entirety.
+
+    Paths are relative to ``target_dir`` and end with a slash.
+    """
+    result = subprocess.run(
+        ['git', 'ls-files', '--others', '--ignored', '--exclude-standard', '--directory', '-z'],
+        cwd=target_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        logger.debug(f"git ls-files failed in {target_dir}: {result.stderr.decode(errors='replace')}")
+        return []
+    return [
+        os.fsdecode(entry) for entry in result.stdout.split(b'\0')
+        if entry.endswith(b'/')
+    ]
+
+
+class GitIgnoreMatcher:
+    """Answers ignore queries through a single long-lived ``git check-ignore --stdin``.
+
+    Each path is written to the process and its verdict read back before the
+    next one is sent, so paths can be checked one at a time as they arrive
+    without paying for a git process per file.
+    """
+
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self._process = None
+
+    def _start(self):
+        env = dict(os.environ, GIT_FLUSH='1')
+        self._process = subprocess.Popen(
+            ['git', 'check-ignore', '--stdin', '-z', '--verbose', '--non-matching'],
+            cwd=self.target_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env
+        )
+
+    def _read_record(self):
+        # Verbose -z output is four NUL-terminated fields: source, line, pattern, path
+        fields = []
+        field = bytearray()
+        stdout = self._process.stdout
+        while len(fields) < 4:
+            char = stdout.read(1)
+            if not char:
+                raise EOFError("git check-ignore exited unexpectedly")
+            if char == b'\0':
+                fields.append(bytes(field))
+                field.clear()
+            else:
+                field += char
+        return fields
+
+    def is_ignored(self, file_path):
+        if self._process is None:
+            self._start()
+        self._process.stdin.write(os.fsencode(file_path) + b'\0')
+        self._process.stdin.flush()
+        source, _, pattern, _ = self._read_record()
+        # A match on a negated pattern ("!keep.log") means the path is re-included
+        return bool(source) and not pattern.startswith(b'!')
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            self._process.stdout.close()
+            self._process.wait()
+            self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _iter_unignored(matcher, file_paths):
+    for file_path in file_paths:
+        try:
+            ignored = matcher.is_ignored(file_path)
+        except (OSError, EOFError) as e:
+            logger.warning(f"Git filtering failed: {e}")
+            yield file_path
+            yield from file_paths
+            return
+        if not ignored:
+            yield file_path
+        else:
+            logger.debug(f"Ignored by git: {file_path}")
+
+
+def iter_unignored_files(target_dir, file_paths, matcher=None):
+    """Yield the paths from ``file_paths`` that git does not ignore, as they arrive.
+
+    Pass a ``GitIgnoreMatcher`` to reuse its git process across calls; the
+    caller is then responsible for closing it.
+    """
+    if matcher is not None:
+        yield from _iter_unignored(matcher, file_paths)
+        return
+
     if not is_git_command_available():
         logger.warning("Git command is not available.")
-        return file_list  # Return the original list if git is not available
+        yield from file_paths
+        return
+
+    if not is_git_work_tree(target_dir):
+        logger.debug(f"{target_dir} is not inside a git work tree, skipping git filtering")
+        yield from file_paths
+        return
 
     logger.debug(f"Filtering ignored files in {target_dir}")
+    with GitIgnoreMatcher(target_dir) as matcher:
+        yield from _iter_unignored(matcher, file_paths)
+
+
+def filter_ignored_files(target_dir, file_list):
     logger.debug(f"Original file list: {file_list}")
-    filtered_list = [
-        file_path for file_path in file_list
-        if not is_ignored_by_git(target_dir, file_path)
-    ]
+    filtered_list = list(iter_unignored_files(target_dir, file_list))
     logger.debug(f"Filtered file list: {filtered_list}")
-    return filtered_list
\ No newline at end of file
+    return filtered_list
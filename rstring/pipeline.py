@@ -0,0 +1,70 @@
+import logging
+import queue
+import threading
+
+from .git import iter_unignored_files
+from .utils import iter_rsync
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch(iterable, maxsize=1024):
+    """Drive ``iterable`` on a background thread and yield its items in order.
+
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((False, item))
+                if stop.is_set():
+                    break
+            items.put((True, None))
+        except Exception as e:
+            items.put((True, e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name="rstring-listing", daemon=True)
+    thread.start()
+    try:
+        while True:
+            finished, value = items.get()
+            if finished:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue so it can notice the stop
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+
+def record_paths(file_paths, file_list):
+    """Pass ``file_paths`` through, appending each one to ``file_list``."""
+    for file_path in file_paths:
+        file_list.append(file_path)
+        yield file_path
+
+
+def iter_files(rsync_args, target_dir, use_gitignore=True, matcher=None):
+    """Yield selected paths, filtering each one through git as rsync lists it."""
+    file_paths = iter_rsync(rsync_args, cwd=target_dir)
+    if use_gitignore:
+        file_paths = iter_unignored_files(target_dir, file_paths, matcher=matcher)
+    return file_paths
+
+
+def stream_files(rsync_args, target_dir, use_gitignore=True, matcher=None):
+    """Overlap listing and git filtering with whatever the caller does per file."""
+    return prefetch(iter_files(rsync_args, target_dir, use_gitignore, matcher=matcher))
@@ -0,0 +1,29 @@
+import os
+import re
+import shlex
+
+from .filters import RsyncFilter
+
+
+def parse_profile(spec):
+    """Parse a ``NAME=RULES`` profile spec into a name and a list of rsync rules."""
+    name, separator, rules = spec.partition('=')
+    if not separator or not re.fullmatch(r'[\w.-]+', name):
+        raise ValueError(f"Invalid profile '{spec}': expected NAME='--include=... --exclude=...'")
+    rules = shlex.split(rules)
+    # Validate the rules up front rather than after the scan
+    RsyncFilter(rules)
+    return name, rules
+
+
+def select_profiles(session, profiles):
+    """Yield ``(name, file_paths)`` for each profile, from a single scan of ``session``.
+
+    Every profile's rules are evaluated in-process against the session's
+    listing, which is itself listed and git-filtered only once.
+    """
+    index = [(file_path, os.path.isdir(os.path.join(session.root, file_path)))
+             for file_path in session.files()]
+    for name, rules in profiles:
+        profile_filter = RsyncFilter(rules)
+        yield name, [file_path for file_path, is_dir in index if profile_filter.is_included(file_path, is_dir)]
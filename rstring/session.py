@@ -0,0 +1,188 @@
+import logging
+import os
+import stat
+
+from .git import GitIgnoreMatcher, is_git_command_available, is_git_work_tree, list_ignored_directories
+from .pipeline import record_paths, stream_files
+from .stats import CollectionStats
+from .tree import iter_tree_lines
+from .utils import format_entry, get_prune_patterns, parse_gitignore
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_patterns():
+    """Conservative default: include everything, let gitignore filter."""
+    return ['--include=*/']
+
+
+class Session:
+    """A reusable view of one directory through a set of rsync filter rules.
+
+    The file listing and the rendered file entries are kept between calls,
+    so repeated queries only pay for a ``stat`` per file. Entries are re-read
+    when a file's mtime or size changes; call ``refresh()`` to pick up added
+    or removed files. Pass ``cache_entries=False`` for a single pass over the
+    files, so that entries aren't held in memory once they've been used.
+
+    Example::
+
+        with Session('path/to/project', ['--include=*/', '--include=*.py', '--exclude=*']) as session:
+            for file_path, entry, is_dir in session.iter_chunks():
+                ...
+    """
+
+    def __init__(self, root, rules=None, use_gitignore=True, preview_length=None, include_dirs=False,
+                 cache_entries=True):
+        self.root = os.path.abspath(root)
+        self.rules = list(rules) if rules else get_default_patterns()
+        self.use_gitignore = use_gitignore
+        self.preview_length = preview_length
+        self.include_dirs = include_dirs
+        self.cache_entries = cache_entries
+
+        self._rsync_args = None
+        self._in_git = None
+        self._matchers = set()
+        self._generation = 0
+        self._files = None
+        self._trees = {}
+        self._entries = {}
+
+    @property
+    def in_git(self):
+        if self._in_git is None:
+            self._in_git = False
+            if self.use_gitignore:
+                if is_git_command_available():
+                    self._in_git = is_git_work_tree(self.root)
+                else:
+                    logger.warning("Git command is not available.")
+        return self._in_git
+
+    @property
+    def rsync_args(self):
+        """The effective rsync arguments: pruned directories, gitignore patterns, then the rules."""
+        if self._rsync_args is None:
+            rsync_args = list(self.rules)
+            sources = [arg for arg in rsync_args if not arg.startswith('--')]
+            if self.use_gitignore:
+                rsync_args = parse_gitignore(os.path.join(self.root, '.gitignore')) + rsync_args
+                # Keep rsync out of wholly ignored directories (node_modules, .venv, ...). The
+                # rules are anchored to the root, so skip them when rsync lists another source.
+                if self.in_git and sources in ([], ['.'], ['./']):
+                    rsync_args = get_prune_patterns(list_ignored_directories(self.root)) + rsync_args
+            # Add default source if none specified
+            if not sources:
+                rsync_args.append('.')
+            self._rsync_args = rsync_args
+        return self._rsync_args
+
+    @rsync_args.setter
+    def rsync_args(self, rsync_args):
+        self._rsync_args = list(rsync_args)
+        self.refresh()
+
+    def _iter_listing(self):
+        if self._files is not None:
+            yield from self._files
+            return
+
+        # Listings can overlap (one started before another is drained) or outlive a
+        # refresh(), so each drives its own git process from its own thread
+        generation = self._generation
+        matcher = GitIgnoreMatcher(self.root) if self.in_git else None
+        if matcher is not None:
+            self._matchers.add(matcher)
+
+        file_list = []
+        try:
+            yield from record_paths(
+                stream_files(self.rsync_args, self.root, self.in_git, matcher=matcher), file_list)
+        finally:
+            if matcher is not None:
+                matcher.close()
+                self._matchers.discard(matcher)
+        if generation == self._generation:
+            self._files = file_list
+
+    def files(self):
+        """Return the selected paths, relative to ``root``, in rsync order."""
+        return list(self._iter_listing())
+
+    def _render(self, file_path):
+        full_path = os.path.join(self.root, file_path)
+        try:
+            path_stat = os.stat(full_path)
+        except OSError:
+            path_stat = None
+
+        signature = (path_stat.st_mtime_ns, path_stat.st_size) if path_stat else None
+        cached = self._entries.get(file_path)
+        if cached is not None and signature is not None and cached[0] == signature:
+            return cached[1], cached[2]
+
+        entry = format_entry(file_path, self.preview_length, self.include_dirs, root=self.root)
+        is_dir = bool(self.include_dirs and path_stat and stat.S_ISDIR(path_stat.st_mode))
+        if self.cache_entries and signature is not None:
+            self._entries[file_path] = (signature, entry, is_dir)
+        return entry, is_dir
+
+    def iter_chunks(self, file_paths=None):
+        """Yield ``(file_path, entry, is_dir)`` for every selected path with output.
+
+        On the first call the listing is streamed, so entries are produced while
+        rsync is still walking the tree. Pass ``file_paths`` to render a subset
+        of the listing in a different order.
+        """
+        for file_path in self._iter_listing() if file_paths is None else file_paths:
+            entry, is_dir = self._render(file_path)
+            if entry is not None:
+                yield file_path, entry, is_dir
+
+    def output(self, stats=None, file_paths=None):
+        """Return the full collection, optionally accumulating totals into ``stats``."""
+        entries = []
+        for file_path, entry, is_dir in self.iter_chunks(file_paths):
+            entries.append(entry)
+            if stats is not None:
+                stats.add(file_path, entry, is_dir=is_dir)
+        return "\n\n".join(entries)
+
+    def stats(self):
+        stats = CollectionStats()
+        for file_path, entry, is_dir in self.iter_chunks():
+            stats.add(file_path, entry, is_dir=is_dir)
+        return stats
+
+    def iter_tree(self, use_color=False, max_depth=None, max_children=None, file_paths=None):
+        """Yield the tree view line by line, without building the whole string."""
+        if file_paths is None:
+            file_paths = self.files()
+        full_paths = [os.path.join(self.root, file_path) for file_path in file_paths]
+        return iter_tree_lines(full_paths, include_dirs=self.include_dirs, use_color=use_color,
+                               max_depth=max_depth, max_children=max_children)
+
+    def tree(self, use_color=False, max_depth=None, max_children=None):
+        key = (use_color, max_depth, max_children)
+        if key not in self._trees:
+            self._trees[key] = "\n".join(self.iter_tree(use_color, max_depth, max_children))
+        return self._trees[key]
+
+    def refresh(self):
+        """Forget the listing so the next call re-scans; cached entries are kept."""
+        self._generation += 1
+        self._files = None
+        self._trees = {}
+
+    def close(self):
+        # Stop the git processes of any listings that were never drained
+        for matcher in list(self._matchers):
+            matcher.close()
+        self._matchers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
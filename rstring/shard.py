@@ -0,0 +1,241 @@
+import glob
+import itertools
+import logging
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from .stats import estimate_tokens
+from .tree import get_tree_string
+from .utils import format_entry, is_binary
+
+logger = logging.getLogger(__name__)
+
+SHARD_HEADER = "### SHARD {} ###\n\n{}\n\n### FILE CONTENTS ###\n"
+# Binary files render as a hexdump of their first 32 bytes, whatever their size
+BINARY_ENTRY_CHARS = len("[Binary file, first 32 bytes: ]") + 64
+
+
+def _header_chars(file_path):
+    return len(f"--- {file_path} ---\n") + 2
+
+
+def _tree_line_chars(path):
+    # Upper bound for a tree line: four prefix characters per level plus the name
+    return len(path) + 4 * (path.count(os.sep) + 1) + 1
+
+
+def _preview_size(path, preview_length):
+    try:
+        with open(path, 'rb') as f:
+            return sum(len(line) for line in itertools.islice(f, preview_length))
+    except OSError:
+        return 0
+
+
+def estimate_file_tokens(root, file_path, include_dirs=True, preview_length=None):
+    """Estimate a file's share of a shard from its size, before reading it.
+
+    Binary files and previews are estimated from what they render to rather
+    than from the file size. Returns None for directories unless
+    ``include_dirs`` is set, as they produce no output then.
+    """
+    full_path = os.path.join(root, file_path)
+    try:
+        path_stat = os.stat(full_path)
+    except OSError:
+        size = 0
+    else:
+        if stat.S_ISDIR(path_stat.st_mode):
+            if not include_dirs:
+                return None
+            size = len("[Directory]")
+        elif preview_length is not None and preview_length <= 0:
+            size = 0
+        elif path_stat.st_size > BINARY_ENTRY_CHARS and is_binary(full_path):
+            size = BINARY_ENTRY_CHARS
+        elif preview_length is not None:
+            size = min(path_stat.st_size, _preview_size(full_path, preview_length))
+        else:
+            size = path_stat.st_size
+    return estimate_tokens(_header_chars(file_path) + size + _tree_line_chars(file_path)) + 1
+
+
+def plan_shards(file_tokens, budget):
+    """Group paths into shards of at most ``budget`` estimated tokens.
+
+    ``file_tokens`` maps relative paths to estimates. Directories are kept in
+    one shard whenever they fit in one; larger directories are split between
+    their children, and a single file over budget gets a shard of its own.
+    Returns a list of path lists, in tree order.
+    """
+    # Directory nodes are keyed with a trailing separator so they can't clash
+    # with an --include-dirs entry for the same directory
+    tree = {}
+    for file_path, tokens in file_tokens.items():
+        parts = file_path.split(os.sep)
+        current = tree
+        for part in parts[:-1]:
+            current = current.setdefault(part + os.sep, {})
+        current[parts[-1]] = (file_path, tokens)
+
+    totals = {}
+
+    def total(node):
+        if isinstance(node, tuple):
+            return node[1]
+        if id(node) not in totals:
+            totals[id(node)] = sum(total(child) for child in node.values())
+        return totals[id(node)]
+
+    def ordered(node):
+        return sorted(node.items(), key=lambda item: (isinstance(item[1], tuple), item[0]))
+
+    def paths(node):
+        if isinstance(node, tuple):
+            return [node[0]]
+        return [path for _, child in ordered(node) for path in paths(child)]
+
+    shards = [[]]
+    remaining = budget
+
+    def start_shard():
+        nonlocal remaining
+        if shards[-1]:
+            shards.append([])
+        remaining = budget
+
+    def add(node, cost):
+        nonlocal remaining
+        shards[-1].extend(paths(node))
+        remaining -= cost
+
+    def visit(node):
+        for _, child in ordered(node):
+            cost = total(child)
+            if cost <= remaining:
+                add(child, cost)
+            elif cost <= budget:
+                start_shard()
+                add(child, cost)
+            elif isinstance(child, dict):
+                visit(child)
+            else:
+                logger.warning(f"{child[0]} alone exceeds the shard budget (~{cost:,} tokens)")
+                start_shard()
+                add(child, cost)
+                start_shard()
+
+    visit(tree)
+    return [shard for shard in shards if shard]
+
+
+class _Shard:
+    """The files of one shard and a running upper bound on its token count."""
+
+    def __init__(self):
+        self.file_paths = []
+        self.entries = []
+        self.directories = set()
+        self.tokens = estimate_tokens(len(SHARD_HEADER))
+
+    def cost(self, file_path, entry):
+        chars = len(entry) + 2 + _tree_line_chars(file_path)
+        directory = os.path.dirname(file_path)
+        while directory and directory not in self.directories:
+            chars += _tree_line_chars(directory)
+            directory = os.path.dirname(directory)
+        return estimate_tokens(chars) + 1
+
+    def add(self, file_path, entry, cost):
+        self.file_paths.append(file_path)
+        self.entries.append(entry)
+        directory = os.path.dirname(file_path)
+        while directory and directory not in self.directories:
+            self.directories.add(directory)
+            directory = os.path.dirname(directory)
+        self.tokens += cost
+
+
+class _ShardWriter:
+    """Renders shards and hands each one to a thread pool as soon as it is full."""
+
+    def __init__(self, root, shard_dir, include_dirs, max_workers):
+        self.root = root
+        self.shard_dir = shard_dir
+        self.include_dirs = include_dirs
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = []
+        self.written = []
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def submit(self, shard):
+        index = len(self.written) + 1
+        full_paths = [os.path.join(self.root, file_path) for file_path in shard.file_paths]
+        tree = get_tree_string(full_paths, include_dirs=self.include_dirs, use_color=False)
+        text = SHARD_HEADER.format(index, tree) + "\n\n".join(shard.entries)
+        path = os.path.join(self.shard_dir, f"shard-{index:03d}.txt")
+        self.written.append((path, len(shard.file_paths), estimate_tokens(len(text))))
+
+        # Bound the number of finished shards held in memory while they're written
+        if len(self.pending) >= self.max_workers:
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(self._write, path, text))
+
+    def close(self):
+        try:
+            for future in self.pending:
+                future.result()
+        finally:
+            self.executor.shutdown()
+
+
+def write_shards(session, budget, shard_dir, max_workers=4):
+    """Split a session's collection into files of at most ``budget`` tokens.
+
+    Each shard starts with a tree of its own files. Shards are filled in
+    planned order and written in the background as soon as they are full.
+    Returns a list of ``(path, file count, estimated tokens)``.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(shard_dir, "shard-*.txt")):
+        os.remove(stale)
+
+    header_tokens = estimate_tokens(len(SHARD_HEADER))
+    file_tokens = {}
+    for file_path in session.files():
+        tokens = estimate_file_tokens(session.root, file_path, session.include_dirs, session.preview_length)
+        if tokens is not None:
+            file_tokens[file_path] = tokens
+    plan = plan_shards(file_tokens, budget - header_tokens)
+
+    writer = _ShardWriter(session.root, shard_dir, session.include_dirs, max_workers)
+    try:
+        shard = _Shard()
+        for planned in plan:
+            # Keep filling the current shard while the next planned group still fits
+            if shard.entries and shard.tokens + sum(file_tokens[path] for path in planned) > budget:
+                writer.submit(shard)
+                shard = _Shard()
+            for file_path in planned:
+                # Bypass the session's entry cache so an entry is freed once its shard is written
+                entry = format_entry(file_path, session.preview_length, session.include_dirs, root=session.root)
+                if entry is None:
+                    continue
+                cost = shard.cost(file_path, entry)
+                # The plan works from file sizes, so spill over if the rendered entry doesn't fit
+                if shard.entries and shard.tokens + cost > budget:
+                    writer.submit(shard)
+                    shard = _Shard()
+                    cost = shard.cost(file_path, entry)
+                shard.add(file_path, entry, cost)
+        if shard.entries:
+            writer.submit(shard)
+    finally:
+        writer.close()
+
+    return writer.written
@@ -0,0 +1,125 @@
+import os
+
+
+def estimate_tokens(chars):
+    # Rough estimate: 1 token ≈ 4 characters
+    return chars // 4
+
+
+def format_size(num_bytes):
+    size = float(num_bytes)
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class CollectionStats:
+    """Running totals for a collection, updated one entry at a time.
+
+    Entries are the ``--- path ---`` blocks produced by ``gather_code``; the
+    collection is those entries joined by a blank line, so totals account for
+    the separator without ever materializing the joined output.
+    """
+
+    def __init__(self):
+        self.entries = 0
+        self.files = 0
+        self.lines = 0
+        self.chars = 0
+        self.bytes = 0
+        self.per_file = {}
+
+    def add(self, file_path, entry, is_dir=False):
+        separator = 1 if self.entries else 0
+        lines = entry.count('\n') + 1
+        chars = len(entry)
+        num_bytes = len(entry.encode('utf-8'))
+
+        self.entries += 1
+        self.lines += lines + separator
+        self.chars += chars + 2 * separator
+        self.bytes += num_bytes + 2 * separator
+        if not is_dir:
+            # Per-file figures cover the entry alone, so they add up within the
+            # totals; lines don't count the "--- path ---" header
+            self.files += 1
+            self.per_file[file_path] = (lines - 1 - entry.endswith('\n'), chars, num_bytes)
+
+    def to_dict(self):
+        return {
+            'entries': self.entries, 'files': self.files, 'lines': self.lines,
+            'chars': self.chars, 'bytes': self.bytes,
+            'per_file': {path: list(totals) for path, totals in self.per_file.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.entries = data['entries']
+        stats.files = data['files']
+        stats.lines = data['lines']
+        stats.chars = data['chars']
+        stats.bytes = data['bytes']
+        stats.per_file = {path: tuple(totals) for path, totals in data['per_file'].items()}
+        return stats
+
+    @property
+    def tokens(self):
+        return estimate_tokens(self.chars)
+
+    def directory_totals(self):
+        """Aggregate per-file totals into every ancestor directory.
+
+        Returns a dict mapping directory path to ``[files, lines, chars, bytes]``.
+        """
+        totals = {}
+        for file_path, (lines, chars, num_bytes) in self.per_file.items():
+            directory = os.path.dirname(os.path.normpath(file_path))
+            while directory and directory not in ('.', os.sep):
+                total = totals.setdefault(directory, [0, 0, 0, 0])
+                total[0] += 1
+                total[1] += lines
+                total[2] += chars
+                total[3] += num_bytes
+                directory = os.path.dirname(directory)
+        return totals
+
+    def top_files(self, n=10):
+        ranked = sorted(self.per_file.items(), key=lambda item: (-item[1][1], item[0]))
+        return ranked[:n]
+
+    def top_directories(self, n=10):
+        ranked = sorted(self.directory_totals().items(), key=lambda item: (-item[1][2], item[0]))
+        return ranked[:n]
+
+    def report(self, n=10):
+        total_chars = self.chars or 1
+
+        def share(chars):
+            return f"{100 * chars / total_chars:5.1f}%"
+
+        lines = ["### COLLECTION STATS ###", "",
+                 f"Files: {self.files}",
+                 f"Lines: {self.lines:,}",
+                 f"Bytes: {format_size(self.bytes)}",
+                 f"Tokens (est.): ~{self.tokens:,}", ""]
+
+        lines.append(f"Top {n} directories by tokens:")
+        top_dirs = self.top_directories(n)
+        if not top_dirs:
+            lines.append("  (none)")
+        for directory, (files, _, chars, num_bytes) in top_dirs:
+            lines.append(f"  {'~' + format(estimate_tokens(chars), ','):>11} tokens  {share(chars)}  "
+                         f"{files:>6,} files  {format_size(num_bytes):>9}  {directory}/")
+
+        lines.append("")
+        lines.append(f"Top {n} files by tokens:")
+        top_files = self.top_files(n)
+        if not top_files:
+            lines.append("  (none)")
+        for file_path, (file_lines, chars, num_bytes) in top_files:
+            lines.append(f"  {'~' + format(estimate_tokens(chars), ','):>11} tokens  {share(chars)}  "
+                         f"{file_lines:>6,} lines  {format_size(num_bytes):>9}  {file_path}")
+
+        return "\n".join(lines)
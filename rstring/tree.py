@@ -3,6 +3,8 @@ import os
 import colorama
 from colorama import Fore, Style
 
+from .stats import format_size
+
 colorama.init()
 
 
@@ -13,63 +15,131 @@ class Colors:
     YELLOW = Fore.YELLOW
 
 
-def get_tree_string(file_list, include_dirs=False, use_color=True):
-    if not file_list:
-        return ""
-
-    common_prefix = os.path.commonprefix(file_list)
-    if not os.path.isdir(common_prefix):
-        common_prefix = os.path.dirname(common_prefix)
+def _build_tree(file_list, include_dirs):
+    """Nest ``file_list`` under its common directory.
 
-    if not common_prefix or common_prefix == '/':
-        common_prefix = '.'
-
-    root_name = os.path.basename(os.path.abspath(common_prefix))
-    tree = {root_name: {}}
+    Directories map to dicts of their children and files map to None, so the
+    renderer never has to stat a path to tell them apart.
+    """
+    common_dir = os.path.commonpath([os.path.dirname(path) or '.' for path in file_list])
+    if not common_dir or common_dir == '/':
+        common_dir = '.'
+    strip = len(common_dir) + 1 if common_dir != '.' else 0
 
+    tree = {}
     for file_path in file_list:
-        relative_path = os.path.relpath(file_path, common_prefix)
+        if strip and file_path.startswith(common_dir + os.sep):
+            relative_path = file_path[strip:]
+        elif not strip and not os.path.isabs(file_path):
+            relative_path = os.path.normpath(file_path)
+        else:
+            relative_path = os.path.relpath(file_path, common_dir)
         parts = relative_path.split(os.sep)
-        current = tree[root_name]
+        current = tree
         for part in parts[:-1]:
-            if part not in current:
+            if current.get(part) is None:
                 current[part] = {}
             current = current[part]
-        if include_dirs or os.path.isfile(file_path):
-            current[parts[-1]] = {}
+        if os.path.isfile(file_path):
+            current.setdefault(parts[-1], None)
+        elif include_dirs:
+            current.setdefault(parts[-1], {} if os.path.isdir(file_path) else None)
+    return common_dir, tree
+
+
+def _count_files(entries, path):
+    """Return the number and total size of files under ``entries``."""
+    files = 0
+    size = 0
+    stack = [(path, entries)]
+    while stack:
+        path, entries = stack.pop()
+        for name, subtree in entries:
+            full_path = os.path.join(path, name)
+            if subtree is None:
+                files += 1
+                try:
+                    size += os.path.getsize(full_path)
+                except OSError:
+                    pass
+            else:
+                stack.append((full_path, subtree.items()))
+    return files, size
 
-    def colorize(text, color):
-        return f"{color}{text}{Colors.RESET}" if use_color else text
 
-    def build_tree_string(node, path, prefix=""):
-        lines = []
-        items = sorted(node.items(), key=lambda x: (not os.path.isdir(os.path.join(path, x[0])), x[0]))
-        for i, (name, subtree) in enumerate(items):
-            is_last = (i == len(items) - 1)
-            full_path = os.path.join(path, name)
-            is_dir = os.path.isdir(full_path)
-            is_executable = os.access(full_path, os.X_OK) and not is_dir
+def _describe_hidden(entries, path, more):
+    files, size = _count_files(entries, path)
+    more = "more " if more else ""
+    if files:
+        return f"… {files:,} {more}file{'s' if files != 1 else ''} ({format_size(size)})"
+    directories = len(entries)
+    return f"… {directories:,} {more}director{'ies' if directories != 1 else 'y'}"
 
-            if is_last:
-                branch = "└── "
-                new_prefix = prefix + "    "
-            else:
-                branch = "├── "
-                new_prefix = prefix + "│   "
 
-            if is_dir:
-                name = colorize(name, Colors.BLUE)
-            elif is_executable:
-                name = colorize(name, Colors.GREEN)
-            elif name.startswith('.'):
-                name = colorize(name, Colors.YELLOW)
+def iter_tree_lines(file_list, include_dirs=False, use_color=True, max_depth=None, max_children=None):
+    """Yield the lines of a tree view of ``file_list`` one at a time.
+
+    Directories deeper than ``max_depth`` are summarized by a single line, as
+    are the children of any directory beyond the first ``max_children``.
+    """
+    if not file_list:
+        return
+
+    common_dir, tree = _build_tree(file_list, include_dirs)
 
-            lines.append(f"{prefix}{branch}{name}")
+    def colorize(text, color):
+        return f"{color}{text}{Colors.RESET}" if use_color else text
+
+    def children(node, path):
+        items = sorted(node.items(), key=lambda item: (item[1] is None, item[0]))
+        if max_children is not None and len(items) > max_children:
+            hidden = items[max_children:]
+            items = items[:max_children] + [(_describe_hidden(hidden, path, more=True), False)]
+        return items
+
+    yield colorize(os.path.basename(os.path.abspath(common_dir)), Colors.BLUE)
+
+    # Each frame is [entries, next index, directory path, line prefix, depth]
+    stack = [[children(tree, common_dir), 0, common_dir, "", 1]]
+    while stack:
+        frame = stack[-1]
+        items, index, path, prefix, depth = frame
+        if index == len(items):
+            stack.pop()
+            continue
+        frame[1] += 1
+
+        name, subtree = items[index]
+        if index == len(items) - 1:
+            branch = "└── "
+            new_prefix = prefix + "    "
+        else:
+            branch = "├── "
+            new_prefix = prefix + "│   "
+
+        if subtree is False:
+            # Summary line for collapsed children
+            yield f"{prefix}{branch}{name}"
+            continue
+
+        full_path = os.path.join(path, name)
+        if subtree is not None:
+            label = colorize(name, Colors.BLUE)
+        elif use_color and os.access(full_path, os.X_OK):
+            label = colorize(name, Colors.GREEN)
+        elif name.startswith('.'):
+            label = colorize(name, Colors.YELLOW)
+        else:
+            label = name
+        yield f"{prefix}{branch}{label}"
+
+        if subtree:
+            if max_depth is not None and depth >= max_depth:
+                yield f"{new_prefix}└── {_describe_hidden(list(subtree.items()), full_path, more=False)}"
+            else:
+                stack.append([children(subtree, full_path), 0, full_path, new_prefix, depth + 1])
 
-            if is_dir:
-                lines.extend(build_tree_string(subtree, full_path, new_prefix))
-        return lines
 
-    result = [colorize(root_name, Colors.BLUE)]
-    result.extend(build_tree_string(tree[root_name], common_prefix))
-    return "\n".join(result)
+def get_tree_string(file_list, include_dirs=False, use_color=True, max_depth=None, max_children=None):
+    return "\n".join(iter_tree_lines(file_list, include_dirs=include_dirs, use_color=use_color,
+                                     max_depth=max_depth, max_children=max_children))
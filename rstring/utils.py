@@ -5,6 +5,7 @@ import platform
 import shlex
 import subprocess
 import sys
+import tempfile
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,17 @@ def parse_gitignore(gitignore_path):
     return gitignore_patterns
 
 
+def get_prune_patterns(directories):
+    """Turn directories relative to the transfer root into anchored rsync excludes."""
+    patterns = []
+    for directory in directories:
+        # rsync only honours backslash escapes in patterns that contain wildcards
+        if any(char in directory for char in '*?['):
+            directory = ''.join('\\' + char if char in '*?[\\' else char for char in directory)
+        patterns.append(f"--exclude=/{directory.rstrip('/')}/")
+    return patterns
+
+
 def check_rsync():
     try:
         subprocess.run(["rsync", "--version"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -40,20 +52,36 @@ def check_rsync():
         return False
 
 
-def run_rsync(args):
+def iter_rsync(args, cwd=None):
+    """Yield file paths from the rsync listing as rsync produces them."""
     cmd = ["rsync", "-ain", "--list-only"] + args
     logger.debug(f"Rsync command: {' '.join(cmd)}")
 
-    try:
-        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        logger.debug(f"Rsync stdout: {result.stdout}")
-        logger.debug(f"Rsync stderr: {result.stderr}")
-        return parse_rsync_output(result.stdout)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Rsync command failed: {e}")
-        logger.error(f"Stdout: {e.stdout}")
-        logger.error(f"Stderr: {e.stderr}")
-        raise
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        completed = False
+        try:
+            for line in process.stdout:
+                file_path = parse_rsync_line(line.rstrip('\n'))
+                if file_path is not None:
+                    yield file_path
+            completed = True
+        finally:
+            if not completed:
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+
+        if returncode != 0:
+            stderr.seek(0)
+            error = subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+            logger.error(f"Rsync command failed: {error}")
+            logger.error(f"Stderr: {error.stderr}")
+            raise error
+
+
+def run_rsync(args):
+    return list(iter_rsync(args))
 
 
 def validate_rsync_args(args):
@@ -64,14 +92,21 @@ def validate_rsync_args(args):
         return False
 
 
+def parse_rsync_line(line):
+    parts = line.split()
+    if len(parts) >= 5 and not line.endswith('/'):
+        file_path = ' '.join(parts[4:])
+        if file_path != '.':  # Exclude the root directory
+            return file_path
+    return None
+
+
 def parse_rsync_output(output):
     file_list = []
     for line in output.splitlines():
-        parts = line.split()
-        if len(parts) >= 5 and not line.endswith('/'):
-            file_path = ' '.join(parts[4:])
-            if file_path != '.':  # Exclude the root directory
-                file_list.append(file_path)
+        file_path = parse_rsync_line(line)
+        if file_path is not None:
+            file_list.append(file_path)
     return file_list
 
 
@@ -83,32 +118,48 @@ def is_binary(file_path):
         return False
 
 
-def gather_code(file_list, preview_length=None, include_dirs=False):
-    template = "--- {} ---\n{}\n\n"
-    result = ""
-    for file_path in file_list:
-        full_path = file_path
-        if os.path.isfile(full_path):
-            try:
-                with open(full_path, 'rb') as file_content:
-                    if is_binary(full_path):
-                        if preview_length is None or preview_length > 0:
-                            file_data = f"[Binary file, first 32 bytes: {binascii.hexlify(file_content.read(32)).decode()}]"
-                    else:
-                        file_data = file_content.read().decode('utf-8', errors='ignore')
-                        file_data = '\n'.join(file_data.splitlines()[:preview_length])
+def format_entry(file_path, preview_length=None, include_dirs=False, root=None):
+    """Render one ``--- path ---`` block, or return None if the path is skipped.
+
+    ``file_path`` is resolved against ``root`` when given, but is shown as is.
+    """
+    template = "--- {} ---\n{}"
+    full_path = os.path.join(root, file_path) if root else file_path
+    if os.path.isfile(full_path):
+        try:
+            with open(full_path, 'rb') as file_content:
+                if is_binary(full_path):
                     if preview_length is None or preview_length > 0:
-                        # result += f"--- {file_path} ---\n{file_data}\n\n"
-                        result += template.format(file_path, file_data)
-                    else:
-                        # result += f"--- {file_path} ---\n\n"
-                        result += template.format(file_path, "")
-            except Exception as e:
-                logger.error(f"Error reading {file_path}: {e}")
-        elif include_dirs and os.path.isdir(full_path):
-            # result += f"--- {file_path} ---\n[Directory]\n\n"
-            result += template.format(file_path, "[Directory]")
-    return result[:-2]
+                        file_data = f"[Binary file, first 32 bytes: {binascii.hexlify(file_content.read(32)).decode()}]"
+                else:
+                    file_data = file_content.read().decode('utf-8', errors='ignore')
+                    file_data = '\n'.join(file_data.splitlines()[:preview_length])
+                if preview_length is None or preview_length > 0:
+                    return template.format(file_path, file_data)
+                else:
+                    return template.format(file_path, "")
+        except Exception as e:
+            logger.error(f"Error reading {file_path}: {e}")
+    elif include_dirs and os.path.isdir(full_path):
+        return template.format(file_path, "[Directory]")
+    return None
+
+
+def iter_entries(file_list, preview_length=None, include_dirs=False):
+    """Yield ``(file_path, entry, is_dir)`` for every path that produces output."""
+    for file_path in file_list:
+        entry = format_entry(file_path, preview_length, include_dirs)
+        if entry is not None:
+            yield file_path, entry, include_dirs and os.path.isdir(file_path)
+
+
+def gather_code(file_list, preview_length=None, include_dirs=False, stats=None):
+    entries = []
+    for file_path, entry, is_dir in iter_entries(file_list, preview_length, include_dirs):
+        entries.append(entry)
+        if stats is not None:
+            stats.add(file_path, entry, is_dir=is_dir)
+    return "\n\n".join(entries)
 
 
 def interactive_mode(initial_args, include_dirs=False, stdout=sys.stdout):
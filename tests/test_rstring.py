@@ -31,14 +31,32 @@ def test_run_rsync():
         "drwxr-xr-x          4,096 2023/04/01 12:00:00 subdir/\n"
         "-rw-r--r--          3,456 2023/04/01 12:00:00 subdir/file3.py\n"
     )
-    with patch('subprocess.run') as mock_run:
-        mock_run.return_value = MagicMock(stdout=mock_output, stderr="")
+    with patch('subprocess.Popen') as mock_popen:
+        process = mock_popen.return_value
+        process.stdout.__iter__.return_value = iter(mock_output.splitlines(keepends=True))
+        process.wait.return_value = 0
         file_list = utils.run_rsync(["--include=*.py", "."])
         assert file_list == ["file1.py", "file2.py", "subdir/file3.py"]
-        mock_run.assert_called_once_with(
-            ["rsync", "-ain", "--list-only", "--include=*.py", "."],
-            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
+        assert mock_popen.call_args[0][0] == ["rsync", "-ain", "--list-only", "--include=*.py", "."]
+
+
+def test_iter_rsync_yields_before_rsync_exits():
+    """Paths are handed out while rsync is still running, and failures surface at the end."""
+    lines = [
+        "-rw-r--r--          1,234 2023/04/01 12:00:00 file1.py\n",
+        "-rw-r--r--          2,345 2023/04/01 12:00:00 file2.py\n",
+    ]
+    with patch('subprocess.Popen') as mock_popen:
+        process = mock_popen.return_value
+        process.stdout.__iter__.return_value = iter(lines)
+        process.wait.return_value = 23
+
+        stream = utils.iter_rsync(["--include=*.py", "."])
+        assert next(stream) == "file1.py"
+        process.wait.assert_not_called()
+        assert next(stream) == "file2.py"
+        with pytest.raises(subprocess.CalledProcessError):
+            next(stream)
 
 
 def test_validate_rsync_args():
@@ -161,31 +179,29 @@ def test_main_with_default_patterns():
     mock_gathered_code = 'print("Hello")\n' * 26
 
     with patch('rstring.cli.check_rsync', return_value=True):
-        with patch('rstring.cli.run_rsync', return_value=['test.py']):
-            with patch('rstring.cli.gather_code', return_value=mock_gathered_code):
+        with patch('rstring.session.stream_files', return_value=iter(['test.py'])) as mock_stream:
+            with patch('rstring.session.format_entry', return_value=mock_gathered_code):
                 with patch('rstring.cli.copy_to_clipboard') as mock_copy:
-                    with patch('rstring.cli.get_tree_string', return_value='test.py'):
-                        with patch('rstring.cli.filter_ignored_files', return_value=['test.py']):
-                            with patch.dict(os.environ, {'RSTRING_TESTING': 'True'}):
-                                with patch('sys.argv', ['rstring']):
-                                    cli.main()
-                                    mock_copy.assert_called_once_with(mock_gathered_code)
+                    with patch('rstring.session.iter_tree_lines', return_value=iter(['test.py'])):
+                        with patch.dict(os.environ, {'RSTRING_TESTING': 'True'}):
+                            with patch('sys.argv', ['rstring']):
+                                cli.main()
+                                mock_copy.assert_called_once_with(mock_gathered_code)
+                                assert '--include=*/' in mock_stream.call_args[0][0]
 
 
-@patch('rstring.cli.filter_ignored_files')
-@patch('rstring.cli.run_rsync')
-@patch('rstring.cli.gather_code')
+@patch('rstring.session.stream_files')
+@patch('rstring.session.format_entry')
 @patch('rstring.cli.copy_to_clipboard')
-@patch('rstring.cli.get_tree_string')
+@patch('rstring.session.iter_tree_lines')
 @patch('rstring.cli.check_rsync')
 def test_main_with_target_directory(mock_check_rsync, mock_get_tree_string,
-                                   mock_copy_to_clipboard, mock_gather_code, mock_run_rsync, mock_filter_ignored):
+                                   mock_copy_to_clipboard, mock_format_entry, mock_stream_files):
     """Test main function with target directory functionality."""
     mock_check_rsync.return_value = True
-    mock_run_rsync.return_value = ['test.py']
-    mock_gather_code.return_value = 'test content'
-    mock_get_tree_string.return_value = 'tree'
-    mock_filter_ignored.return_value = ['test.py']
+    mock_stream_files.return_value = iter(['test.py'])
+    mock_format_entry.return_value = 'test content'
+    mock_get_tree_string.return_value = iter(['tree'])
 
     with tempfile.TemporaryDirectory() as temp_dir:
         # Create a test file
@@ -271,28 +287,626 @@ def test_get_default_patterns():
 def test_no_gitignore_flag_skips_git_filtering():
     """Test that --no-gitignore flag skips git filtering, preventing regression of the bug where git filtering was applied regardless of the flag."""
     with patch('rstring.cli.check_rsync', return_value=True):
-        with patch('rstring.cli.run_rsync', return_value=['test.py']):
-            with patch('rstring.cli.filter_ignored_files') as mock_filter:
-                with patch('rstring.cli.gather_code', return_value='test content'):
-                    with patch('rstring.cli.copy_to_clipboard'):
-                        with patch('rstring.cli.get_tree_string', return_value='test.py'):
-                            with patch.dict(os.environ, {'RSTRING_TESTING': 'True'}):
-                                with patch('sys.argv', ['rstring', '--no-gitignore']):
-                                    cli.main()
-                                    # Should not call filter_ignored_files when --no-gitignore is used
-                                    mock_filter.assert_not_called()
+        with patch('rstring.session.stream_files', return_value=iter(['test.py'])) as mock_stream:
+            with patch('rstring.session.is_git_work_tree', return_value=True):
+                with patch('rstring.cli.copy_to_clipboard'):
+                    with patch('rstring.session.iter_tree_lines', return_value=iter(['test.py'])):
+                        with patch.dict(os.environ, {'RSTRING_TESTING': 'True'}):
+                            with patch('sys.argv', ['rstring', '--no-gitignore']):
+                                cli.main()
+                                # Should not ask for git filtering when --no-gitignore is used
+                                assert mock_stream.call_args[0][2] is False
+
+    with patch('rstring.pipeline.iter_rsync', return_value=iter(['test.py'])):
+        with patch('rstring.pipeline.iter_unignored_files') as mock_filter:
+            from rstring.pipeline import iter_files
+            assert list(iter_files(['.'], '.', use_gitignore=False)) == ['test.py']
+            mock_filter.assert_not_called()
 
 
 def test_default_behavior_applies_git_filtering():
     """Test that default behavior (without --no-gitignore) applies git filtering."""
     with patch('rstring.cli.check_rsync', return_value=True):
-        with patch('rstring.cli.run_rsync', return_value=['test.py']):
-            with patch('rstring.cli.filter_ignored_files', return_value=['test.py']) as mock_filter:
-                with patch('rstring.cli.gather_code', return_value='test content'):
-                    with patch('rstring.cli.copy_to_clipboard'):
-                        with patch('rstring.cli.get_tree_string', return_value='test.py'):
-                            with patch.dict(os.environ, {'RSTRING_TESTING': 'True'}):
-                                with patch('sys.argv', ['rstring']):
-                                    cli.main()
-                                    # Should call filter_ignored_files when --no-gitignore is not used
-                                    mock_filter.assert_called_once()
+        with patch('rstring.session.stream_files', return_value=iter(['test.py'])) as mock_stream:
+            with patch('rstring.session.is_git_work_tree', return_value=True):
+                with patch('rstring.cli.copy_to_clipboard'):
+                    with patch('rstring.session.iter_tree_lines', return_value=iter(['test.py'])):
+                        with patch.dict(os.environ, {'RSTRING_TESTING': 'True'}):
+                            with patch('sys.argv', ['rstring']):
+                                cli.main()
+                                # Should ask for git filtering when --no-gitignore is not used
+                                assert mock_stream.call_args[0][2] is True
+
+    with patch('rstring.pipeline.iter_rsync', return_value=iter(['test.py', 'ignored.log'])):
+        with patch('rstring.pipeline.iter_unignored_files', return_value=iter(['test.py'])) as mock_filter:
+            from rstring.pipeline import iter_files
+            assert list(iter_files(['.'], '.', use_gitignore=True)) == ['test.py']
+            mock_filter.assert_called_once()
+
+
+def test_gather_code_collects_stats_incrementally():
+    """Stats gathered alongside the output match counting the joined result."""
+    from rstring.stats import CollectionStats
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, 'pkg', 'sub'))
+        contents = {
+            'a.py': 'print("a")\n',
+            os.path.join('pkg', 'b.py'): 'x = 1\ny = 2\nz = 3\n',
+            os.path.join('pkg', 'sub', 'c.md'): '# Title\n\nünïcode body\n',
+        }
+        file_list = []
+        for rel_path, content in contents.items():
+            path = os.path.join(temp_dir, rel_path)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            file_list.append(path)
+
+        stats = CollectionStats()
+        result = gather_code(file_list, stats=stats)
+
+    assert stats.files == 3
+    assert stats.lines == len(result.splitlines())
+    assert stats.chars == len(result)
+    assert stats.bytes == len(result.encode('utf-8'))
+    assert stats.tokens == len(result) // 4
+
+    # Per-file figures cover each entry alone, so only the separators are left over
+    assert sum(chars for _, chars, _ in stats.per_file.values()) + 2 * (stats.entries - 1) == stats.chars
+    assert stats.per_file[file_list[0]][0] == 1
+
+    directories = stats.directory_totals()
+    pkg_dir = os.path.join(temp_dir, 'pkg')
+    assert directories[pkg_dir][0] == 2
+    assert directories[os.path.join(pkg_dir, 'sub')][0] == 1
+
+
+def test_stats_report_ranks_heaviest_paths():
+    from rstring.stats import CollectionStats
+
+    stats = CollectionStats()
+    stats.add('src/big.py', '--- src/big.py ---\n' + 'x' * 400)
+    stats.add('src/small.py', '--- src/small.py ---\nx')
+    stats.add('docs/readme.md', '--- docs/readme.md ---\n' + 'y' * 100)
+
+    assert [path for path, _ in stats.top_files(2)] == ['src/big.py', 'docs/readme.md']
+    assert [path for path, _ in stats.top_directories(1)] == ['src']
+
+    report = stats.report(2)
+    assert "Files: 3" in report
+    assert "src/" in report
+    assert "src/small.py" not in report
+
+
+def test_main_stats_leaves_positional_directory_alone(capsys):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, 'test.py'), 'w') as f:
+            f.write('print("test")')
+
+        with patch('rstring.cli.check_rsync', return_value=True):
+            with patch('rstring.session.stream_files', return_value=iter(['test.py'])):
+                with patch('sys.argv', ['rstring', '--stats', temp_dir, '--no-gitignore', '-nc',
+                                        '--stats-top', '3']):
+                    cli.main()
+
+    captured = capsys.readouterr()
+    assert '--- test.py ---' in captured.out
+    assert "Top 3 files by tokens:" in captured.err
+
+
+def test_iter_unignored_files_streams_through_one_git_process():
+    from rstring.git import iter_unignored_files, is_git_command_available
+    if not is_git_command_available():
+        pytest.skip("git is not available")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        subprocess.run(['git', 'init', '-q'], cwd=temp_dir, check=True)
+        with open(os.path.join(temp_dir, '.gitignore'), 'w') as f:
+            f.write("build/\n*.log\n!keep.log\n")
+
+        paths = ['main.py', 'debug.log', 'keep.log', 'build/out.o', 'docs/guide.md']
+        with patch('rstring.git.subprocess.run', wraps=subprocess.run) as mock_run:
+            kept = list(iter_unignored_files(temp_dir, iter(paths)))
+            # Only the availability and work tree checks shell out per call
+            assert mock_run.call_count == 2
+
+    assert kept == ['main.py', 'keep.log', 'docs/guide.md']
+
+
+def test_prefetch_preserves_order_and_reraises():
+    from rstring.pipeline import prefetch
+
+    assert list(prefetch(iter(range(5000)), maxsize=8)) == list(range(5000))
+
+    def failing():
+        yield 'a.py'
+        raise subprocess.CalledProcessError(23, 'rsync')
+
+    stream = prefetch(failing())
+    assert next(stream) == 'a.py'
+    with pytest.raises(subprocess.CalledProcessError):
+        next(stream)
+
+
+def test_ignored_directories_become_anchored_excludes():
+    from rstring.git import list_ignored_directories, is_git_command_available
+    from rstring.utils import get_prune_patterns
+    if not is_git_command_available():
+        pytest.skip("git is not available")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        subprocess.run(['git', 'init', '-q'], cwd=temp_dir, check=True)
+        with open(os.path.join(temp_dir, '.gitignore'), 'w') as f:
+            f.write("node_modules/\n__pycache__/\n*.log\n")
+        for rel_path in ['node_modules/pkg/index.js', 'src/__pycache__/m.pyc', 'src/m.py', 'debug.log']:
+            path = os.path.join(temp_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+        directories = list_ignored_directories(temp_dir)
+
+    assert sorted(directories) == ['node_modules/', 'src/__pycache__/']
+    assert get_prune_patterns(sorted(directories)) == [
+        '--exclude=/node_modules/', '--exclude=/src/__pycache__/'
+    ]
+    assert get_prune_patterns(['odd[1]*/']) == ['--exclude=/odd\\[1]\\*/']
+
+
+def test_prune_patterns_only_apply_to_the_default_source():
+    """Root-anchored prune rules would land on the wrong directories under another source."""
+    from rstring import Session
+    from rstring.git import is_git_command_available
+    if not is_git_command_available():
+        pytest.skip("git is not available")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        subprocess.run(['git', 'init', '-q'], cwd=temp_dir, check=True)
+        with open(os.path.join(temp_dir, '.git', 'info', 'exclude'), 'a') as f:
+            f.write("/build/\n")
+        for rel_path in ['build/out.o', 'src/build/gen.py']:
+            path = os.path.join(temp_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+        assert '--exclude=/build/' in Session(temp_dir).rsync_args
+        assert Session(temp_dir, ['--include=*/', '.']).rsync_args[0] == '--exclude=/build/'
+        rsync_args = Session(temp_dir, ['--include=*/', 'src/']).rsync_args
+        assert '--exclude=/build/' not in rsync_args
+        assert rsync_args[-1] == 'src/'
+
+
+@pytest.mark.parametrize("use_git", [True, False])
+def test_tree_fingerprint_tracks_edits(use_git):
+    from rstring.cache import tree_fingerprint
+    from rstring.git import is_git_command_available
+    if use_git and not is_git_command_available():
+        pytest.skip("git is not available")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if use_git:
+            subprocess.run(['git', 'init', '-q'], cwd=temp_dir, check=True)
+        path = os.path.join(temp_dir, 'main.py')
+        with open(path, 'w') as f:
+            f.write('print("one")\n')
+
+        first = tree_fingerprint(temp_dir)
+        assert tree_fingerprint(temp_dir) == first
+        assert first.startswith('git:' if use_git else 'stat:')
+
+        with open(path, 'a') as f:
+            f.write('print("two")\n')
+        second = tree_fingerprint(temp_dir)
+        assert second != first
+
+        # A second edit to an already-dirty file must still change it
+        with open(path, 'a') as f:
+            f.write('print("three")\n')
+        assert tree_fingerprint(temp_dir) != second
+
+        if use_git:
+            # A stat-only change makes git status rewrite the index; that must
+            # settle within the same fingerprint, not the next one
+            subprocess.run(['git', 'add', 'main.py'], cwd=temp_dir, check=True)
+            subprocess.run(['git', '-c', 'user.name=rstring', '-c', 'user.email=rstring@example.com',
+                            'commit', '-q', '-m', 'init'], cwd=temp_dir, check=True)
+            tree_fingerprint(temp_dir)
+            os.utime(path, (1_000_000_000, 1_000_000_000))
+            assert tree_fingerprint(temp_dir) == tree_fingerprint(temp_dir)
+
+            # git status only lists a nested repository as "vendor/", but its files are collected
+            vendor_dir = os.path.join(temp_dir, 'vendor')
+            os.makedirs(vendor_dir)
+            subprocess.run(['git', 'init', '-q'], cwd=vendor_dir, check=True)
+            lib_path = os.path.join(vendor_dir, 'lib.py')
+            with open(lib_path, 'w') as f:
+                f.write('VERSION = 1\n')
+            before = tree_fingerprint(temp_dir)
+            directory_mtime = os.stat(vendor_dir).st_mtime_ns
+            with open(lib_path, 'w') as f:
+                f.write('VERSION = 2\n')
+            os.utime(vendor_dir, ns=(directory_mtime, directory_mtime))
+            assert tree_fingerprint(temp_dir) != before
+
+        # Empty directories are collected with --include-dirs, but git doesn't see them
+        before = tree_fingerprint(temp_dir, include_dirs=True)
+        os.mkdir(os.path.join(temp_dir, 'newdir'))
+        assert tree_fingerprint(temp_dir, include_dirs=True) != before
+
+
+def test_main_cache_hit_skips_collection():
+    """A second run over an unchanged tree reuses the stored output."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = os.path.join(temp_dir, 'cache')
+        project_dir = os.path.join(temp_dir, 'project')
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, 'test.py'), 'w') as f:
+            f.write('print("test")')
+
+        with patch('rstring.cli.check_rsync', return_value=True):
+            with patch('rstring.cli.copy_to_clipboard') as mock_copy:
+                with patch.dict(os.environ, {'RSTRING_TESTING': 'True', 'RSTRING_CACHE_DIR': cache_dir}):
+                    with patch('sys.argv', ['rstring', '-C', project_dir, '--no-gitignore', '--cache']):
+                        with patch('rstring.session.stream_files', return_value=iter(['test.py'])) as mock_stream:
+                            cli.main()
+                            assert mock_stream.call_count == 1
+                        with patch('rstring.session.stream_files') as mock_stream:
+                            cli.main()
+                            mock_stream.assert_not_called()
+
+        assert mock_copy.call_count == 2
+        assert mock_copy.call_args_list[0] == mock_copy.call_args_list[1]
+        assert '--- test.py ---\nprint("test")' == mock_copy.call_args[0][0]
+
+
+def test_session_reuses_listing_and_entries():
+    """A session lists once and only re-reads files whose stat changed."""
+    from rstring import Session
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, 'pkg'))
+        for rel_path, content in [('a.py', 'A = 1'), ('pkg/b.py', 'B = 2')]:
+            with open(os.path.join(temp_dir, rel_path), 'w') as f:
+                f.write(content)
+
+        with patch('rstring.session.stream_files', side_effect=lambda *a, **k: iter(['a.py', 'pkg/b.py'])) as mock_stream:
+            with Session(temp_dir, use_gitignore=False) as session:
+                assert session.files() == ['a.py', 'pkg/b.py']
+                assert session.output() == "--- a.py ---\nA = 1\n\n--- pkg/b.py ---\nB = 2"
+                assert session.stats().files == 2
+                root_name = os.path.basename(temp_dir)
+                assert session.tree() == f"{root_name}\n├── pkg\n│   └── b.py\n└── a.py"
+                assert mock_stream.call_count == 1
+
+                with patch('rstring.session.format_entry', wraps=utils.format_entry) as mock_format:
+                    list(session.iter_chunks())
+                    mock_format.assert_not_called()
+
+                    with open(os.path.join(temp_dir, 'a.py'), 'w') as f:
+                        f.write('A = 10')
+                    chunks = list(session.iter_chunks())
+                    assert mock_format.call_count == 1
+                    assert chunks[0] == ('a.py', "--- a.py ---\nA = 10", False)
+
+                session.refresh()
+                session.files()
+                assert mock_stream.call_count == 2
+
+
+def test_session_without_entry_cache_holds_no_entries():
+    from rstring import Session
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, 'a.py'), 'w') as f:
+            f.write('A = 1')
+
+        with patch('rstring.session.stream_files', return_value=iter(['a.py'])):
+            with Session(temp_dir, use_gitignore=False, cache_entries=False) as session:
+                with patch('rstring.session.format_entry', wraps=utils.format_entry) as mock_format:
+                    assert session.output() == "--- a.py ---\nA = 1"
+                    assert session.output() == "--- a.py ---\nA = 1"
+                    assert mock_format.call_count == 2
+                assert session._entries == {}
+
+
+def test_main_streaming_run_does_not_cache_entries():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, 'test.py'), 'w') as f:
+            f.write('print("test")')
+
+        with patch('rstring.cli.check_rsync', return_value=True):
+            with patch('rstring.session.stream_files', return_value=iter(['test.py'])):
+                with patch('rstring.cli.Session', wraps=cli.Session) as mock_session:
+                    with patch('sys.argv', ['rstring', temp_dir, '--no-gitignore', '-nc']):
+                        cli.main()
+                    assert mock_session.call_args[1]['cache_entries'] is False
+
+
+def test_session_overlapping_listings_stay_filtered():
+    """A listing started, or a refresh made, while another is being drained."""
+    from rstring import Session
+    from rstring.git import is_git_command_available
+    if not is_git_command_available():
+        pytest.skip("git is not available")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        subprocess.run(['git', 'init', '-q'], cwd=temp_dir, check=True)
+        with open(os.path.join(temp_dir, '.gitignore'), 'w') as f:
+            f.write("*.log\n")
+        listing = []
+        for i in range(500):
+            for name in (f'mod{i}.py', f'mod{i}.log'):
+                with open(os.path.join(temp_dir, name), 'w') as f:
+                    f.write(name)
+                listing.append(name)
+        expected = [name for name in listing if name.endswith('.py')]
+
+        with patch('rstring.pipeline.iter_rsync', side_effect=lambda *a, **k: iter(listing)):
+            with Session(temp_dir) as session:
+                chunks = session.iter_chunks()
+                first = [next(chunks)[0]]
+                assert session.files() == expected
+                first.extend(file_path for file_path, _, _ in chunks)
+                assert first == expected
+
+                session.refresh()
+                chunks = session.iter_chunks()
+                first = [next(chunks)[0]]
+                session.refresh()
+                first.extend(file_path for file_path, _, _ in chunks)
+                assert first == expected
+                assert session.files() == expected
+
+
+def test_tree_depth_and_children_limits():
+    from rstring.tree import iter_tree_lines
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_list = ['src/pkg/deep.py', 'src/main.py', 'big/a.txt', 'big/b.txt', 'big/c.txt', 'top.py']
+        for rel_path in file_list:
+            path = os.path.join(temp_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('x' * 10)
+        file_list = [os.path.join(temp_dir, path) for path in file_list]
+        root_name = os.path.basename(temp_dir)
+
+        lines = iter_tree_lines(file_list, use_color=False, max_depth=1)
+        assert not isinstance(lines, (list, str))
+        assert list(lines) == [
+            root_name,
+            "├── big",
+            "│   └── … 3 files (30 B)",
+            "├── src",
+            "│   └── … 2 files (20 B)",
+            "└── top.py",
+        ]
+
+        assert get_tree_string(file_list, use_color=False, max_children=2) == "\n".join([
+            root_name,
+            "├── big",
+            "│   ├── a.txt",
+            "│   ├── b.txt",
+            "│   └── … 1 more file (10 B)",
+            "├── src",
+            "│   ├── pkg",
+            "│   │   └── deep.py",
+            "│   └── main.py",
+            "└── … 1 more file (10 B)",
+        ])
+
+
+@pytest.mark.parametrize("extra_args", [
+    ['--tree-depth', '0'],
+    ['--tree-depth', '-2'],
+    ['--tree-max-children', '-1'],
+])
+def test_main_rejects_invalid_tree_limits(extra_args):
+    with patch('rstring.cli.check_rsync', return_value=True):
+        with patch('rstring.session.stream_files') as mock_stream:
+            with patch('sys.argv', ['rstring', '--summary'] + extra_args):
+                with pytest.raises(SystemExit):
+                    main()
+            mock_stream.assert_not_called()
+
+
+def test_plan_shards_keeps_directories_together():
+    from rstring.shard import plan_shards
+
+    file_tokens = {
+        os.path.join('a', 'x.py'): 30,
+        os.path.join('a', 'y.py'): 30,
+        os.path.join('b', 'z.py'): 50,
+        os.path.join('b', 'c', 'w.py'): 20,
+        'huge.bin': 500,
+        'top.py': 10,
+    }
+    assert plan_shards(file_tokens, 100) == [
+        [os.path.join('a', 'x.py'), os.path.join('a', 'y.py')],
+        [os.path.join('b', 'c', 'w.py'), os.path.join('b', 'z.py')],
+        ['huge.bin'],
+        ['top.py'],
+    ]
+    # A directory over budget is split between its children
+    assert plan_shards(file_tokens, 60)[:3] == [
+        [os.path.join('a', 'x.py'), os.path.join('a', 'y.py')],
+        [os.path.join('b', 'c', 'w.py')],
+        [os.path.join('b', 'z.py')],
+    ]
+
+
+def test_write_shards_stays_under_budget():
+    from rstring import Session
+    from rstring.shard import estimate_file_tokens, write_shards
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'project')
+        shard_dir = os.path.join(temp_dir, 'shards')
+        listing = []
+        file_list = []
+        for directory in ['alpha', 'beta', 'gamma']:
+            os.makedirs(os.path.join(project_dir, directory))
+            listing.append(directory)
+            for i in range(3):
+                rel_path = os.path.join(directory, f'mod{i}.py')
+                with open(os.path.join(project_dir, rel_path), 'w') as f:
+                    f.write(f'# {rel_path}\n' + 'x = 1\n' * 40)
+                file_list.append(rel_path)
+        listing.extend(file_list)
+
+        # Directories only count when they are rendered
+        assert estimate_file_tokens(project_dir, 'alpha', include_dirs=False) is None
+        assert estimate_file_tokens(project_dir, 'alpha', include_dirs=True) > 0
+
+        with patch('rstring.session.stream_files', return_value=iter(listing)):
+            with Session(project_dir, use_gitignore=False) as session:
+                shards = write_shards(session, 250, shard_dir, max_workers=2)
+                assert session._entries == {}
+
+        assert len(shards) > 1
+        seen = []
+        for index, (path, num_files, tokens) in enumerate(shards, 1):
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            assert len(text) // 4 == tokens <= 250
+            assert text.startswith(f"### SHARD {index} ###\n")
+            seen.extend(line[4:-4] for line in text.splitlines() if line.startswith('--- '))
+        assert sorted(seen) == sorted(file_list)
+
+
+def test_write_shards_estimates_previews_and_binaries():
+    """Files are planned by what they render to, and planned groups share shards."""
+    from rstring import Session
+    from rstring.shard import estimate_file_tokens, write_shards
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'project')
+        shard_dir = os.path.join(temp_dir, 'shards')
+        file_list = []
+        for i in range(20):
+            rel_path = os.path.join(f'pkg{i}', 'mod.py')
+            os.makedirs(os.path.join(project_dir, f'pkg{i}'))
+            with open(os.path.join(project_dir, rel_path), 'w') as f:
+                f.write('value = 1234567890\n' * 650)
+            file_list.append(rel_path)
+        with open(os.path.join(project_dir, 'blob.bin'), 'wb') as f:
+            f.write(b'\0' * 400_000)
+        file_list.append('blob.bin')
+
+        assert estimate_file_tokens(project_dir, 'blob.bin') < 50
+        assert estimate_file_tokens(project_dir, file_list[0], preview_length=5) < 50
+
+        with patch('rstring.session.stream_files', return_value=iter(file_list)):
+            with Session(project_dir, use_gitignore=False, preview_length=5) as session:
+                with patch('rstring.shard.logger') as mock_logger:
+                    shards = write_shards(session, 5000, shard_dir)
+                    mock_logger.warning.assert_not_called()
+
+        assert len(shards) == 1
+        assert shards[0][1] == 21
+
+
+@pytest.mark.parametrize("extra_args", [
+    ['--shard-tokens', '0'],
+    ['--shard-tokens', '-5'],
+    ['--shard-tokens', '10'],
+    ['--shard-tokens', '1000', '--summary'],
+    ['--shard-tokens', '1000', '--stats'],
+    ['--shard-tokens', '1000', '--cache'],
+    ['--shard-tokens', '1000', '--verify-cache'],
+])
+def test_main_rejects_unsupported_shard_options(extra_args):
+    with patch('rstring.cli.check_rsync', return_value=True):
+        with patch('rstring.cli.write_shards') as mock_write:
+            with patch('sys.argv', ['rstring', '--shard-dir', 'shards'] + extra_args):
+                with pytest.raises(SystemExit):
+                    main()
+            mock_write.assert_not_called()
+
+
+@pytest.mark.parametrize("rules, path, is_dir, expected", [
+    ([], 'src/main.py', False, True),
+    (['--include=*.py', '--exclude=*'], 'main.py', False, True),
+    (['--include=*.py', '--exclude=*'], 'src/main.py', False, False),  # src/ itself is excluded
+    (['--include=*/', '--include=*.py', '--exclude=*'], 'src/main.py', False, True),
+    (['--include=*/', '--include=*.py', '--exclude=*'], 'src/README.md', False, False),
+    (['--exclude=build/'], 'build', True, False),
+    (['--exclude=build/'], 'build', False, True),  # Trailing slash only matches directories
+    (['--exclude=build/'], 'pkg/build/out.o', False, False),
+    (['--exclude=/build'], 'pkg/build', True, True),  # Anchored to the root
+    (['--exclude=docs/*.md'], 'site/docs/index.md', False, False),
+    (['--exclude=docs/*.md'], 'docs/api/index.md', False, True),
+    (['--exclude=docs/**.md'], 'docs/api/index.md', False, False),
+    (['--include', 'src/***', '--exclude', '*'], 'src/pkg/mod.py', False, True),
+    (['--include', 'src/***', '--exclude', '*'], 'lib/mod.py', False, False),
+    (['--exclude=test?.py'], 'tests/test1.py', False, False),
+    (['--exclude=[!a]*.py'], 'b.py', False, False),
+    (['--exclude=[!a]*.py'], 'a.py', False, True),
+])
+def test_rsync_filter_semantics(rules, path, is_dir, expected):
+    from rstring.filters import RsyncFilter
+
+    assert RsyncFilter(rules).is_included(path, is_dir) == expected
+
+
+def test_parse_profile_rejects_unsupported_rules():
+    from rstring.profiles import parse_profile
+
+    assert parse_profile("src=--include=*/ --include='*.py' --exclude=*") == (
+        'src', ['--include=*/', '--include=*.py', '--exclude=*'])
+    with pytest.raises(ValueError):
+        parse_profile("src=--filter='- *.pyc'")
+    with pytest.raises(ValueError):
+        parse_profile("../escape=--include=*")
+
+
+@pytest.mark.parametrize("extra_args", [
+    ['--shard-tokens', '1000', '--shard-dir', 'shards'],
+    ['--stats'],
+    ['--cache'],
+    ['--verify-cache'],
+])
+def test_main_rejects_unsupported_profile_options(extra_args):
+    with patch('rstring.cli.check_rsync', return_value=True):
+        with patch('rstring.cli.write_profiles') as mock_write:
+            with patch('sys.argv', ['rstring', '--profile', 'src=--include=*.py', '--profile-dir', 'views']
+                       + extra_args):
+                with pytest.raises(SystemExit):
+                    main()
+            mock_write.assert_not_called()
+
+
+def test_profiles_share_one_scan_and_read_files_once():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'project')
+        profile_dir = os.path.join(temp_dir, 'profiles')
+        file_list = ['docs', 'docs/guide.md', 'src', 'src/main.py', 'setup.cfg', 'README.md']
+        for rel_path in file_list:
+            path = os.path.join(project_dir, rel_path)
+            if '.' not in rel_path:
+                os.makedirs(path)
+            else:
+                with open(path, 'w') as f:
+                    f.write(f'contents of {rel_path}')
+
+        argv = ['-C', project_dir, '--no-gitignore', '--profile-dir', profile_dir,
+                '--profile', 'code=--include=*/ --include=*.py --exclude=*',
+                '--profile', 'docs=--include=*/ --include=*.md --exclude=*',
+                '--profile', 'everything=']
+        with patch('rstring.cli.check_rsync', return_value=True):
+            with patch('rstring.session.stream_files', return_value=iter(file_list)) as mock_stream:
+                with patch('rstring.session.format_entry', wraps=utils.format_entry) as mock_format:
+                    with patch('builtins.print'):
+                        cli.main(argv)
+
+        assert mock_stream.call_count == 1
+        rendered = [call.args[0] for call in mock_format.call_args_list]
+        assert sorted(rendered) == sorted(set(rendered))
+
+        def read(name):
+            with open(os.path.join(profile_dir, f'{name}.txt')) as f:
+                return f.read()
+
+        assert read('code') == '--- src/main.py ---\ncontents of src/main.py'
+        assert read('docs') == ('--- docs/guide.md ---\ncontents of docs/guide.md\n\n'
+                                '--- README.md ---\ncontents of README.md')
+        assert read('everything').count('--- ') == 4